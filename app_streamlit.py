@@ -3,8 +3,10 @@ from streamlit_folium import st_folium
 import folium
 import requests
 import json
+import math
 import pandas as pd
-from shapely.geometry import Point, shape
+from shapely.geometry import Point, shape, box
+from shapely.strtree import STRtree
 import io
 import csv
 
@@ -29,15 +31,44 @@ if 'calculation_done' not in st.session_state:
     st.session_state.calculation_done = False
 if 'addresses' not in st.session_state:
     st.session_state.addresses = []
+if 'address_index' not in st.session_state:
+    st.session_state.address_index = None  # Index spatial construit une fois par jeu d'adresses
 if 'start_point_method' not in st.session_state:
     st.session_state.start_point_method = "map"  # Méthode par défaut: map ou address
 if 'map_center' not in st.session_state:
     st.session_state.map_center = [st.session_state.lat, st.session_state.lon]
 if 'map_zoom' not in st.session_state:
     st.session_state.map_zoom = 14
+if 'accessibility_grid' not in st.session_state:
+    st.session_state.accessibility_grid = None  # Grille des temps de trajet autour du point de départ
+if 'show_heatmap' not in st.session_state:
+    st.session_state.show_heatmap = False
+if 'last_map_view' not in st.session_state:
+    st.session_state.last_map_view = None  # Derniers (centre, zoom, emprise) renvoyés par la carte
+if 'map_bounds' not in st.session_state:
+    st.session_state.map_bounds = None  # Emprise visible (sud, ouest, nord, est) renvoyée par la carte
+if 'drawn_address_positions' not in st.session_state:
+    st.session_state.drawn_address_positions = None  # Positions des adresses dessinées lors du dernier affichage
 if 'map_height' not in st.session_state:
     st.session_state.map_height = 70  # Hauteur par défaut en pourcentage de la hauteur de la fenêtre
 
+# Dimensions approximatives de la carte affichée (en pixels), utilisées pour estimer l'emprise visible
+# lors du premier affichage, avant que la carte ne renvoie son emprise réelle
+MAP_HEIGHT_PX = 600
+MAP_WIDTH_PX = 1200
+# Marge ajoutée autour de l'emprise visible (en fraction de sa taille) pour éviter les marqueurs manquants en bordure
+VIEWPORT_MARGIN = 0.5
+# Nombre maximal de marqueurs d'adresses dessinés sur la carte ; au-delà, l'utilisateur doit zoomer
+MAX_VISIBLE_MARKERS = 500
+
+# Vitesses moyennes approximatives (km/h) utilisées pour dimensionner la grille d'accessibilité
+MODE_SPEEDS_KMH = {"foot-walking": 5, "cycling-regular": 15, "driving-car": 50}
+# Nombre maximal de destinations par requête à l'API Matrix
+MATRIX_CHUNK_SIZE = 200
+# Limites du cache des requêtes Matrix (partagé entre toutes les sessions) : durée de vie et nombre de lots conservés
+MATRIX_CACHE_TTL = "1h"
+MATRIX_CACHE_MAX_ENTRIES = 1000
+
 st.title("Zones accessibles sur carte")
 
 # Configuration de la clé API
@@ -109,7 +140,8 @@ def geocode_multiple_addresses(addresses_list):
                         "lat": result["lat"],
                         "lon": result["lon"],
                         "in_zone": None,
-                        "travel_time": None
+                        "travel_time": None,
+                        "travel_time_source": None
                     })
                 else:
                     # Ajouter quand même l'adresse avec des valeurs nulles pour montrer qu'elle a échoué
@@ -119,7 +151,8 @@ def geocode_multiple_addresses(addresses_list):
                         "lat": None,
                         "lon": None,
                         "in_zone": None,
-                        "travel_time": None
+                        "travel_time": None,
+                        "travel_time_source": None
                     })
     
     return results
@@ -132,13 +165,16 @@ def set_start_point_by_address():
         st.session_state.lon = address_data["lon"]
         # Centrer la carte sur le nouveau point
         st.session_state.map_center = [address_data["lat"], address_data["lon"]]
+        st.session_state.map_bounds = None  # L'emprise sera estimée jusqu'au prochain déplacement de la carte
         st.session_state.calculation_done = False
         st.session_state.geojson_data = None
+        st.session_state.accessibility_grid = None
         # Réinitialiser les résultats des adresses précédentes
         if st.session_state.addresses:
             for addr in st.session_state.addresses:
                 addr["in_zone"] = None
                 addr["travel_time"] = None
+                addr["travel_time_source"] = None
         st.success(f"Point de départ défini à : {address_data['address']}")
         return True
     return False
@@ -188,6 +224,106 @@ def is_point_in_isochrone(point_lat, point_lon, geojson_data):
     
     return False
 
+# Fonction pour remplacer la liste des adresses (l'index spatial sera reconstruit au prochain usage)
+def set_addresses(addresses):
+    st.session_state.addresses = addresses
+    st.session_state.address_index = None
+
+# Fonction pour construire l'index spatial (STRtree) des adresses géocodées
+def build_address_index(addresses):
+    points = []
+    positions = []  # Position de chaque point de l'arbre dans la liste des adresses
+    for i, addr in enumerate(addresses):
+        if addr["lat"] is not None and addr["lon"] is not None:
+            points.append(Point(addr["lon"], addr["lat"]))
+            positions.append(i)
+
+    return {
+        "tree": STRtree(points),
+        "positions": positions
+    }
+
+# Fonction pour obtenir l'index spatial des adresses, construit une seule fois par jeu d'adresses
+def get_address_index():
+    if st.session_state.address_index is None:
+        st.session_state.address_index = build_address_index(st.session_state.addresses)
+    return st.session_state.address_index
+
+# Fonction pour obtenir les positions des adresses situées dans la zone isochrone
+def find_addresses_in_isochrone(geojson_data):
+    if not geojson_data or "features" not in geojson_data:
+        return None
+
+    index = get_address_index()
+    in_zone = set()
+
+    # L'arbre filtre d'abord par l'emprise du polygone, puis teste l'inclusion exacte
+    for feature in geojson_data["features"]:
+        polygon = shape(feature["geometry"])
+        for tree_idx in index["tree"].query(polygon, predicate="contains"):
+            in_zone.add(index["positions"][tree_idx])
+
+    return in_zone
+
+# Fonction pour obtenir les positions des adresses situées dans une emprise (sud, ouest, nord, est)
+# Les longitudes peuvent dépasser ±180° (Leaflet ne les ramène pas dans cet intervalle)
+def find_addresses_in_bounds(bounds):
+    south, west, north, east = bounds
+
+    if east - west >= 360:
+        # L'emprise couvre tout le globe en longitude
+        boxes = [box(-180, south, 180, north)]
+    else:
+        # Ramener l'ouest dans [-180, 180[ et découper l'emprise si elle traverse l'antiméridien
+        offset = ((west + 180) // 360) * 360
+        west, east = west - offset, east - offset
+        boxes = [box(west, south, min(east, 180), north)]
+        if east > 180:
+            boxes.append(box(-180, south, east - 360, north))
+
+    index = get_address_index()
+    positions = set()
+    for query_box in boxes:
+        for tree_idx in index["tree"].query(query_box, predicate="intersects"):
+            positions.add(index["positions"][tree_idx])
+    return sorted(positions)
+
+# Fonction pour estimer l'emprise visible de la carte à partir du centre et du niveau de zoom
+# (utilisée tant que la carte n'a pas encore renvoyé son emprise réelle)
+def get_viewport_bounds(center, zoom, width_px=MAP_WIDTH_PX, height_px=MAP_HEIGHT_PX, margin=VIEWPORT_MARGIN):
+    # Projection Web Mercator : 256 pixels pour 360 degrés au zoom 0
+    world_px = 256 * 2 ** zoom
+    center_lat, center_lon = center
+
+    center_x = (center_lon + 180) / 360 * world_px
+    sin_lat = math.sin(math.radians(center_lat))
+    center_y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world_px
+
+    half_width = width_px * (1 + margin) / 2
+    half_height = height_px * (1 + margin) / 2
+
+    def pixel_to_lat(y):
+        n = math.pi - 2 * math.pi * y / world_px
+        return math.degrees(math.atan(math.sinh(n)))
+
+    west = (center_x - half_width) / world_px * 360 - 180
+    east = (center_x + half_width) / world_px * 360 - 180
+    north = pixel_to_lat(max(center_y - half_height, 0))
+    south = pixel_to_lat(min(center_y + half_height, world_px))
+
+    return south, west, north, east
+
+# Fonction pour obtenir les positions des adresses à afficher dans l'emprise visible de la carte
+# Retourne None si elles sont trop nombreuses pour être dessinées
+def get_visible_address_positions():
+    viewport_bounds = st.session_state.map_bounds
+    if viewport_bounds is None:
+        viewport_bounds = get_viewport_bounds(st.session_state.map_center, st.session_state.map_zoom)
+    positions = find_addresses_in_bounds(viewport_bounds)
+    if len(positions) > MAX_VISIBLE_MARKERS:
+        return None
+    return positions
+
 # Fonction pour mettre à jour la carte et calculer les isochrones
 def calculate_isochrone():
     st.session_state.calculation_done = True
@@ -225,29 +361,183 @@ def calculate_isochrone():
             st.code(traceback.format_exc())
             return False
 
+# Fonction pour obtenir les durées de trajet depuis un point vers plusieurs destinations (API Matrix)
+# Les résultats sont mis en cache ; une erreur lève une exception pour ne pas être mise en cache.
+# La clé API fait partie des arguments (et donc de la clé du cache) : une session ne réutilise jamais
+# des résultats obtenus avec la clé d'un autre utilisateur.
+@st.cache_data(show_spinner=False, ttl=MATRIX_CACHE_TTL, max_entries=MATRIX_CACHE_MAX_ENTRIES)
+def fetch_matrix_durations(api_key, start_lat, start_lon, destinations, mode):
+    url = f"https://api.openrouteservice.org/v2/matrix/{mode}"
+    headers = {
+        "Authorization": api_key,
+        "Content-Type": "application/json; charset=utf-8",
+        "Accept": "application/json"
+    }
+    params = {
+        "locations": [[start_lon, start_lat]] + [[lon, lat] for lat, lon in destinations],
+        "sources": [0],
+        "destinations": list(range(1, len(destinations) + 1)),
+        "metrics": ["duration"]
+    }
+
+    response = requests.post(url, json=params, headers=headers)
+    if response.status_code != 200:
+        raise RuntimeError(f"Erreur lors de l'appel à l'API Matrix : {response.status_code}")
+
+    # Convertir les durées en minutes (None si la destination est inaccessible)
+    durations = response.json()["durations"][0]
+    return [d / 60 if d is not None else None for d in durations]
+
+# Fonction pour calculer la grille d'accessibilité (temps de trajet pour chaque cellule) autour du point de départ
+def calculate_accessibility_grid(cells_per_side):
+    start_lat = st.session_state.lat
+    start_lon = st.session_state.lon
+    mode = st.session_state.mode
+    minutes = st.session_state.minutes
+
+    # Rayon couvert par la grille, estimé à partir de la vitesse moyenne du mode de déplacement
+    radius_km = MODE_SPEEDS_KMH.get(mode, 5) * minutes / 60 * 1.2
+    step_lat = 2 * radius_km / cells_per_side / 111.32
+    step_lon = step_lat / math.cos(math.radians(start_lat))
+    south = start_lat - step_lat * (cells_per_side - 1) / 2
+    west = start_lon - step_lon * (cells_per_side - 1) / 2
+
+    centers = [
+        (round(south + row * step_lat, 6), round(west + col * step_lon, 6))
+        for row in range(cells_per_side)
+        for col in range(cells_per_side)
+    ]
+
+    travel_times = []
+    with st.spinner(f"Calcul des temps de trajet pour {len(centers)} cellules..."):
+        try:
+            for i in range(0, len(centers), MATRIX_CHUNK_SIZE):
+                chunk = tuple(centers[i:i + MATRIX_CHUNK_SIZE])
+                travel_times.extend(fetch_matrix_durations(ORS_API_KEY, start_lat, start_lon, chunk, mode))
+        except Exception as e:
+            st.error(f"Une erreur s'est produite lors du calcul de la grille : {str(e)}")
+            return False
+
+    st.session_state.accessibility_grid = {
+        "start": (start_lat, start_lon),
+        "mode": mode,
+        "minutes": minutes,
+        "south": south,
+        "west": west,
+        "step_lat": step_lat,
+        "step_lon": step_lon,
+        "cells_per_side": cells_per_side,
+        "cell_km": 2 * radius_km / cells_per_side,
+        "travel_times": travel_times  # Ligne par ligne, du sud vers le nord et de l'ouest vers l'est
+    }
+    return True
+
+# Fonction pour vérifier que la grille d'accessibilité correspond au point de départ et au mode actuels,
+# et à la durée actuelle si check_minutes (la durée détermine la taille de la grille et l'échelle des couleurs,
+# mais pas les temps de trajet eux-mêmes)
+def is_accessibility_grid_current(grid, check_minutes=True):
+    if not grid:
+        return False
+
+    if check_minutes and grid["minutes"] != st.session_state.minutes:
+        return False
+
+    return grid["start"] == (st.session_state.lat, st.session_state.lon) and grid["mode"] == st.session_state.mode
+
+# Fonction pour estimer le temps de trajet vers un point à partir de la grille d'accessibilité
+def estimate_travel_time_from_grid(point_lat, point_lon, grid):
+    # La grille n'est valable que pour le point de départ et le mode avec lesquels elle a été calculée
+    if not is_accessibility_grid_current(grid, check_minutes=False):
+        return None
+
+    row = round((point_lat - grid["south"]) / grid["step_lat"])
+    col = round((point_lon - grid["west"]) / grid["step_lon"])
+    if not (0 <= row < grid["cells_per_side"] and 0 <= col < grid["cells_per_side"]):
+        return None
+
+    return grid["travel_times"][row * grid["cells_per_side"] + col]
+
+# Fonction pour obtenir le temps de trajet vers un point, par la grille si possible, sinon par l'API
+# Retourne le temps de trajet et sa source : "grid" (temps du centre de la cellule la plus proche) ou "route"
+def get_travel_time(point_lat, point_lon):
+    travel_time = estimate_travel_time_from_grid(point_lat, point_lon, st.session_state.accessibility_grid)
+    if travel_time is not None:
+        return travel_time, "grid"
+
+    travel_time = calculate_travel_time(
+        st.session_state.lat,
+        st.session_state.lon,
+        point_lat,
+        point_lon,
+        st.session_state.mode
+    )
+    return travel_time, "route" if travel_time is not None else None
+
+# Fonction pour décrire la source d'un temps de trajet (pour les infobulles et le tableau des résultats)
+def format_travel_time_source(source):
+    if source == "grid":
+        grid = st.session_state.accessibility_grid
+        if grid:
+            return f"approximation par grille (cellules de {grid['cell_km']:.1f} km)"
+        return "approximation par grille"
+    if source == "route":
+        return "itinéraire calculé"
+    return "N/A"
+
+# Fonction pour choisir la couleur d'une cellule de la carte de chaleur selon le temps de trajet
+def get_heatmap_color(travel_time, max_minutes):
+    colors = ["#1a9850", "#91cf60", "#d9ef8b", "#fee08b", "#fc8d59", "#d73027"]
+    ratio = min(travel_time / max_minutes, 1) if max_minutes else 1
+    return colors[min(int(ratio * len(colors)), len(colors) - 1)]
+
+# Fonction pour convertir la grille d'accessibilité en GeoJSON (une cellule carrée par temps connu)
+def accessibility_grid_to_geojson(grid):
+    features = []
+    half_lat = grid["step_lat"] / 2
+    half_lon = grid["step_lon"] / 2
+
+    for i, travel_time in enumerate(grid["travel_times"]):
+        if travel_time is None:
+            continue
+        row, col = divmod(i, grid["cells_per_side"])
+        lat = grid["south"] + row * grid["step_lat"]
+        lon = grid["west"] + col * grid["step_lon"]
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[
+                    [lon - half_lon, lat - half_lat],
+                    [lon + half_lon, lat - half_lat],
+                    [lon + half_lon, lat + half_lat],
+                    [lon - half_lon, lat + half_lat],
+                    [lon - half_lon, lat - half_lat]
+                ]]
+            },
+            "properties": {
+                "travel_time": round(travel_time, 1),
+                "color": get_heatmap_color(travel_time, grid["minutes"])
+            }
+        })
+
+    return {"type": "FeatureCollection", "features": features}
+
 # Fonction pour vérifier toutes les adresses en une fois
 def check_all_addresses():
     if not st.session_state.addresses or not st.session_state.geojson_data:
         return
         
     with st.spinner(f"Vérification de {len(st.session_state.addresses)} adresses..."):
-        for addr in st.session_state.addresses:
+        # Classer toutes les adresses en une seule requête sur l'index spatial
+        in_zone = find_addresses_in_isochrone(st.session_state.geojson_data)
+
+        for i, addr in enumerate(st.session_state.addresses):
             if addr["lat"] is not None and addr["lon"] is not None:
                 # Vérifier si l'adresse est dans la zone
-                addr["in_zone"] = is_point_in_isochrone(
-                    addr["lat"], 
-                    addr["lon"], 
-                    st.session_state.geojson_data
-                )
-                
-                # Calculer le temps de trajet
-                addr["travel_time"] = calculate_travel_time(
-                    st.session_state.lat,
-                    st.session_state.lon,
-                    addr["lat"],
-                    addr["lon"],
-                    st.session_state.mode
-                )
+                addr["in_zone"] = (i in in_zone) if in_zone is not None else None
+
+                # Calculer le temps de trajet (par la grille d'accessibilité si elle est disponible)
+                addr["travel_time"], addr["travel_time_source"] = get_travel_time(addr["lat"], addr["lon"])
 
 # Fonction pour créer la carte interactive
 def create_map():
@@ -262,6 +552,20 @@ def create_map():
         icon=folium.Icon(color="red", icon="info-sign")
     ).add_to(m)
     
+    # Ajouter la carte de chaleur si demandée (et calculée pour le mode actuel), sous la zone isochrone et les marqueurs
+    if st.session_state.show_heatmap and is_accessibility_grid_current(st.session_state.accessibility_grid):
+        folium.GeoJson(
+            data=accessibility_grid_to_geojson(st.session_state.accessibility_grid),
+            name="Carte de chaleur",
+            style_function=lambda x: {
+                'fillColor': x['properties']['color'],
+                'color': x['properties']['color'],
+                'weight': 0,
+                'fillOpacity': 0.5
+            },
+            tooltip=folium.GeoJsonTooltip(fields=["travel_time"], aliases=["Temps de trajet (min) :"])
+        ).add_to(m)
+
     # Ajouter la zone isochrone si calculée
     if st.session_state.calculation_done and st.session_state.geojson_data:
         # Ajouter les isochrones avant les marqueurs pour une meilleure visibilité
@@ -286,7 +590,11 @@ def create_map():
     # Ajouter des marqueurs pour les adresses vérifiées
     mode_texte = {"foot-walking": "à pied", "cycling-regular": "à vélo", "driving-car": "en voiture"}
     if st.session_state.addresses:
-        for i, addr in enumerate(st.session_state.addresses):
+        # Ne charger que les adresses situées dans l'emprise visible de la carte (aucune si elles sont trop nombreuses)
+        visible_positions = get_visible_address_positions()
+        st.session_state.drawn_address_positions = visible_positions
+        for i in visible_positions or []:
+            addr = st.session_state.addresses[i]
             if addr["lat"] is not None and addr["lon"] is not None:
                 # Choisir la couleur en fonction du résultat de la vérification
                 icon_color = "green" if addr["in_zone"] else "black"
@@ -294,7 +602,10 @@ def create_map():
                 # Préparer le contenu du popup avec les informations détaillées
                 travel_time_text = ""
                 if addr["travel_time"] is not None:
-                    travel_time_text = f"<b>Temps de trajet estimé:</b> {addr['travel_time']:.1f} minutes<br>"
+                    travel_time_text = (
+                        f"<b>Temps de trajet estimé:</b> {addr['travel_time']:.1f} minutes "
+                        f"({format_travel_time_source(addr.get('travel_time_source'))})<br>"
+                    )
                 
                 popup_html = f"""
                 <div style="width: 300px; max-width: 100%;">
@@ -315,6 +626,8 @@ def create_map():
                 tooltip_text = f"{addr['geocoded_address']}"
                 if addr["travel_time"] is not None:
                     tooltip_text = f"{addr['geocoded_address']} - {addr['travel_time']:.1f} min {mode_texte.get(st.session_state.mode, st.session_state.mode)}"
+                    if addr.get("travel_time_source") == "grid":
+                        tooltip_text += " (approximation par grille)"
                 
                 # Ajouter le marqueur avec les informations détaillées
                 folium.Marker(
@@ -334,19 +647,36 @@ def create_map():
                         opacity=0.7,
                         dash_array='5, 5',
                         tooltip=f"Trajet: {addr['travel_time']:.1f} min {mode_texte.get(st.session_state.mode, st.session_state.mode)}"
+                                + (" (approximation par grille)" if addr.get("travel_time_source") == "grid" else "")
                     ).add_to(m)
     
     return m
 
 # Mise à jour des coordonnées lorsqu'un point est sélectionné sur la carte
 def update_coordinates(clicked_data):
-    if clicked_data and clicked_data.get("last_clicked"):
-        # Sauvegarder le centre et le niveau de zoom actuels
-        if clicked_data.get("center"):
+    # Sauvegarder le centre et le niveau de zoom seulement si l'utilisateur a déplacé la carte,
+    # pour ne pas écraser un centre défini par ailleurs (ex : point de départ par adresse).
+    # Une réponse sans centre est la réponse par défaut du composant (ex : après sa recréation) :
+    # son emprise est celle de tous les éléments dessinés, pas la partie visible de la carte.
+    view_changed = False
+    if clicked_data and clicked_data.get("center"):
+        map_view = (clicked_data.get("center"), clicked_data.get("zoom"), clicked_data.get("bounds"))
+        if map_view != st.session_state.last_map_view:
+            st.session_state.last_map_view = map_view
+            view_changed = True
             st.session_state.map_center = [clicked_data["center"]["lat"], clicked_data["center"]["lng"]]
-        if clicked_data.get("zoom"):
-            st.session_state.map_zoom = clicked_data["zoom"]
-            
+            if clicked_data.get("zoom"):
+                st.session_state.map_zoom = clicked_data["zoom"]
+            bounds = clicked_data.get("bounds")
+            if bounds and bounds.get("_southWest") and bounds.get("_northEast"):
+                st.session_state.map_bounds = (
+                    bounds["_southWest"]["lat"],
+                    bounds["_southWest"]["lng"],
+                    bounds["_northEast"]["lat"],
+                    bounds["_northEast"]["lng"]
+                )
+
+    if clicked_data and clicked_data.get("last_clicked"):
         # Mettre à jour les coordonnées du point seulement si en mode carte et un clic a eu lieu
         if st.session_state.start_point_method == "map":
             new_lat = clicked_data["last_clicked"]["lat"]
@@ -359,12 +689,23 @@ def update_coordinates(clicked_data):
                 # Réinitialiser le calcul si un nouveau point est sélectionné
                 st.session_state.calculation_done = False
                 st.session_state.geojson_data = None
+                st.session_state.accessibility_grid = None
                 # Réinitialiser les résultats des adresses précédentes
                 if st.session_state.addresses:
                     for addr in st.session_state.addresses:
                         addr["in_zone"] = None
                         addr["travel_time"] = None
+                        addr["travel_time_source"] = None
                 return True
+
+    # La carte a été dessinée avec l'ancienne emprise : la redessiner seulement si les adresses
+    # visibles ne sont plus celles qui ont été dessinées
+    if (
+        view_changed
+        and st.session_state.addresses
+        and get_visible_address_positions() != st.session_state.drawn_address_positions
+    ):
+        st.rerun()
     return False
 
 # Obtenir les dimensions de l'écran pour adapter la carte
@@ -402,7 +743,7 @@ with col1:
     map_object = create_map()
     
     # Définir une hauteur fixe en pixels pour garantir la visibilité de la carte
-    fixed_height = 600
+    fixed_height = MAP_HEIGHT_PX
     
     # Afficher la carte avec une hauteur fixe
     clicked_data = st_folium(
@@ -410,9 +751,15 @@ with col1:
         width="100%", 
         height=fixed_height,
         key="unified_map",
-        returned_objects=["last_clicked", "center", "zoom"]
+        # Centre et zoom transmis séparément pour que déplacer la carte ne recrée pas le composant
+        center=st.session_state.map_center,
+        zoom=st.session_state.map_zoom,
+        returned_objects=["last_clicked", "center", "zoom", "bounds"]
     )
     
+    if st.session_state.addresses and st.session_state.drawn_address_positions is None:
+        st.info(f"Plus de {MAX_VISIBLE_MARKERS} adresses dans la partie visible de la carte : zoomez pour les afficher.")
+
     # Mettre à jour les coordonnées si nécessaire et si en mode carte
     if update_coordinates(clicked_data) and st.session_state.start_point_method == "map":
         st.rerun()  # Actualiser pour refléter les changements
@@ -462,6 +809,21 @@ with col2:
         calculate_isochrone()
         st.rerun()  # Actualiser pour afficher les résultats
 
+    # Section pour la carte de chaleur des temps de trajet
+    st.subheader("Carte de chaleur")
+    cells_per_side = st.slider(
+        "Résolution de la grille (cellules par côté)", 5, 40, 15, key="grid_resolution_slider",
+        help="La grille couvre la distance atteignable en la durée choisie ; les temps de trajet sont calculés par lots"
+    )
+    if st.button("Calculer la carte de chaleur", key="heatmap_button"):
+        if calculate_accessibility_grid(cells_per_side):
+            st.session_state.show_heatmap = True
+            st.rerun()  # Actualiser pour afficher les résultats
+    if is_accessibility_grid_current(st.session_state.accessibility_grid):
+        st.checkbox("Afficher la carte de chaleur", key="show_heatmap")
+    elif st.session_state.accessibility_grid:
+        st.info("La carte de chaleur a été calculée pour un autre mode de déplacement ou une autre durée. Recalculez-la pour l'afficher.")
+
     # Séparateur
     st.markdown("---")
     
@@ -491,7 +853,8 @@ with col2:
                         "lat": address_data["lat"],
                         "lon": address_data["lon"],
                         "in_zone": None,
-                        "travel_time": None
+                        "travel_time": None,
+                        "travel_time_source": None
                     }
                     
                     # Vérifier si l'adresse est dans la zone
@@ -501,17 +864,14 @@ with col2:
                         st.session_state.geojson_data
                     )
                     
-                    # Calculer le temps de trajet
-                    new_address["travel_time"] = calculate_travel_time(
-                        st.session_state.lat,
-                        st.session_state.lon,
+                    # Calculer le temps de trajet (par la grille d'accessibilité si elle est disponible)
+                    new_address["travel_time"], new_address["travel_time_source"] = get_travel_time(
                         new_address["lat"],
-                        new_address["lon"],
-                        st.session_state.mode
+                        new_address["lon"]
                     )
                     
                     # Ajouter à la liste des adresses
-                    st.session_state.addresses = [new_address]
+                    set_addresses([new_address])
                     st.rerun()  # Actualiser pour afficher les résultats
     
     with address_tabs[1]:
@@ -533,7 +893,7 @@ with col2:
                 
                 if addresses_list:
                     # Géocoder toutes les adresses
-                    st.session_state.addresses = geocode_multiple_addresses(addresses_list)
+                    set_addresses(geocode_multiple_addresses(addresses_list))
                     
                     # Vérifier toutes les adresses
                     check_all_addresses()
@@ -605,7 +965,7 @@ with col2:
                     
                     if addresses_list:
                         # Géocoder toutes les adresses
-                        st.session_state.addresses = geocode_multiple_addresses(addresses_list)
+                        set_addresses(geocode_multiple_addresses(addresses_list))
                         
                         # Vérifier toutes les adresses
                         check_all_addresses()
@@ -638,6 +998,8 @@ if st.session_state.calculation_done and st.session_state.addresses:
         df_display["in_zone"] = df_display["in_zone"].apply(
             lambda x: "✅ Oui" if x else "❌ Non" if x is not None else "N/A"
         )
+    if "travel_time_source" in df_display.columns:
+        df_display["travel_time_source"] = df_display["travel_time_source"].apply(format_travel_time_source)
     
     # Renommer les colonnes pour l'affichage
     df_display = df_display.rename(columns={
@@ -646,7 +1008,8 @@ if st.session_state.calculation_done and st.session_state.addresses:
         "lat": "Latitude",
         "lon": "Longitude",
         "in_zone": "Dans la zone",
-        "travel_time": "Temps de trajet"
+        "travel_time": "Temps de trajet",
+        "travel_time_source": "Source du temps de trajet"
     })
     
     # Afficher le tableau